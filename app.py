@@ -7,18 +7,26 @@ Author: OSM to DXF Converter
 Version: 1.0.0
 """
 
+import gc
+import json
+import multiprocessing
 import os
 import uuid
 import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from pathlib import Path
+from queue import Empty
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
-from flask import Flask, request, jsonify, render_template, send_file, abort
+from flask import Flask, Response, request, jsonify, render_template, send_file, abort, stream_with_context
 from flask_cors import CORS
 
 # Import our converter
-from osm_to_dxf import OSMHandler, DXFGenerator
+from osm_to_dxf import OSMHandler, DXFGenerator, rtree
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
@@ -28,13 +36,79 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['SECRET_KEY'] = 'osm-to-dxf-converter-secret-key'
+app.config['MAX_JOBS'] = 100  # Finished jobs beyond this are evicted, oldest first
+# Offload downloads to the front-end server: set USE_X_SENDFILE behind apache/lighttpd,
+# or X_ACCEL_REDIRECT_PREFIX to an internal nginx location aliasing OUTPUT_FOLDER
+app.config['USE_X_SENDFILE'] = False
+app.config['X_ACCEL_REDIRECT_PREFIX'] = None
 
 # Ensure directories exist
 Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
 Path(app.config['OUTPUT_FOLDER']).mkdir(exist_ok=True)
 
-# Global storage for conversion jobs
-conversion_jobs = {}
+# Global storage for conversion jobs, least recently used first
+conversion_jobs = OrderedDict()
+jobs_lock = threading.Lock()
+jobs_updated = threading.Condition(jobs_lock)  # Notified whenever a job changes state
+
+# Conversions run in separate processes so concurrent jobs use all cores. Workers are
+# spawned rather than forked, as forking a multi-threaded server process is unsafe.
+mp_context = multiprocessing.get_context('spawn')
+executor = None
+executor_lock = threading.Lock()
+
+# Set in each worker process: queue for sending progress updates to the Flask process
+worker_progress = None
+
+def init_worker(progress_queue):
+    """Process pool initializer: remember the progress queue of this pool."""
+    global worker_progress
+    worker_progress = progress_queue
+
+def report_progress(job_id, progress, message, **fields):
+    """Send a progress update for a job from a worker process."""
+    if worker_progress is not None:
+        worker_progress.put((job_id, dict(progress=progress, message=message, **fields)))
+
+def drain_progress(progress_queue, pool):
+    """Apply progress updates sent by the workers of a pool until the pool is replaced."""
+    while True:
+        try:
+            job_id, fields = progress_queue.get(timeout=1)
+        except Empty:
+            if executor is not pool:
+                return
+            continue
+        
+        # Late updates must not overwrite a job that has already finished
+        with jobs_lock:
+            job = conversion_jobs.get(job_id)
+        if job is not None:
+            update_job(job, only_if_active=True, **fields)
+
+def get_executor():
+    """Return the conversion process pool, creating it on first use."""
+    global executor
+    with executor_lock:
+        if executor is None:
+            # A fresh queue per pool, since a killed worker can leave the old one locked
+            progress_queue = mp_context.Queue()
+            executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=mp_context,
+                initializer=init_worker,
+                initargs=(progress_queue,)
+            )
+            threading.Thread(target=drain_progress, args=(progress_queue, executor), daemon=True).start()
+        return executor
+
+def reset_executor(broken):
+    """Discard a broken process pool so the next job starts a fresh one."""
+    global executor
+    with executor_lock:
+        if executor is broken:
+            executor = None
+    broken.shutdown(wait=False)
 
 class ConversionJob:
     """Represents a conversion job with status tracking."""
@@ -64,74 +138,187 @@ class ConversionJob:
         self.completed_at = None
         self.error_message = None
         self.output_file = None
+        self.index_file = None  # Basename of the persisted spatial index, if any
         self.stats = {}
+        self.updates = []  # Status snapshot after each update, replayed by event streams
+
+def delete_job_files(job):
+    """Remove the uploaded and converted files of a job."""
+    paths = [Path(app.config['UPLOAD_FOLDER']) / job.filename]
+    if job.output_file:
+        paths.append(Path(app.config['OUTPUT_FOLDER']) / job.output_file)
+    if job.index_file:
+        index_base = Path(app.config['OUTPUT_FOLDER']) / job.index_file
+        paths.extend(index_base.with_name(index_base.name + ext) for ext in ('.idx', '.dat'))
+    
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+def add_job(job):
+    """Store a new job and evict the oldest finished jobs beyond MAX_JOBS."""
+    with jobs_lock:
+        conversion_jobs[job.job_id] = job
+        
+        excess = len(conversion_jobs) - app.config['MAX_JOBS']
+        if excess <= 0:
+            return
+        
+        # Jobs still queued or processing are never evicted
+        evicted = [job_id for job_id, old_job in conversion_jobs.items()
+                   if old_job.status in ('completed', 'error')][:excess]
+        for job_id in evicted:
+            delete_job_files(conversion_jobs.pop(job_id))
+
+def get_job(job_id):
+    """Return a job and mark it as recently used, or None if unknown."""
+    with jobs_lock:
+        job = conversion_jobs.get(job_id)
+        if job is not None:
+            conversion_jobs.move_to_end(job_id)
+    return job
+
+def update_job(job, only_if_active=False, **fields):
+    """Update job attributes and wake up any status event streams.
+
+    With ``only_if_active`` the update is dropped if the job has already
+    finished, checked under the same lock that guards the write.
+    """
+    with jobs_updated:
+        if only_if_active and job.status not in ('pending', 'processing'):
+            return
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updates.append(job_status(job))
+        jobs_updated.notify_all()
+
+def job_status(job):
+    """Build the status payload of a job."""
+    status = {
+        'job_id': job.job_id,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at.isoformat(),
+        'stats': job.stats
+    }
+    
+    if job.completed_at:
+        status['completed_at'] = job.completed_at.isoformat()
+        status['duration'] = (job.completed_at - job.created_at).total_seconds()
+    
+    if job.error_message:
+        status['error'] = job.error_message
+    
+    if job.output_file:
+        status['download_url'] = f'/api/download/{job.job_id}'
+    
+    return status
+
+def fail_job(job, error):
+    """Mark a job as failed with the given error message."""
+    update_job(
+        job,
+        status='error',
+        message=f'Conversion failed: {error}',
+        error_message=error,
+        progress=0
+    )
 
 def allowed_file(filename):
-    """Check if file extension is allowed."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'osm', 'xml'}
+    """Check if file extension is allowed. PBF is preferred for large extracts."""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'osm', 'xml', 'pbf'}
+
+def convert_osm_to_dxf(params, report):
+    """Convert OSM to DXF in a worker process and return the job result.
+    
+    Runs outside the Flask process, so it only receives plain job parameters,
+    sends progress through report(progress, message, **fields) and returns
+    its result (or raises).
+    """
+    input_path = Path(params['input_path'])
+    output_path = Path(params['output_path'])
+    
+    report(10, 'Starting conversion...')
+    
+    # Parse OSM data
+    report(20, 'Parsing OSM data...')
+    handler = OSMHandler()
+    handler.apply_file(str(input_path))
+    
+    stats = {
+        'nodes': len(handler.nodes),
+        'ways': len(handler.ways),
+        'relations': handler.relation_count
+    }
+    report(50, f"Parsed {stats['nodes']} nodes, {stats['ways']} ways, {stats['relations']} relations",
+           stats=dict(stats))
+    
+    # Generate DXF
+    report(70, 'Generating DXF...')
+    dxf_gen = DXFGenerator(params['projection'], params['use_colors'])
+    
+    # Process data
+    report(70, 'Processing nodes...')
+    dxf_gen.process_nodes(handler.nodes)
+    
+    report(85, 'Processing ways...')
+    dxf_gen.process_ways(handler.ways, handler.nodes)
+    
+    # Save DXF file
+    report(95, 'Saving DXF file...')
+    dxf_gen.save(str(output_path))
+    
+    stats['layers'] = len(dxf_gen.created_layers)
+    stats['file_size'] = output_path.stat().st_size
+    
+    # Persist a spatial index of the ways for later bbox queries
+    index_file = None
+    if rtree is not None:
+        report(98, 'Building spatial index...')
+        index_file = output_path.stem
+        dxf_gen.build_spatial_index(str(output_path.with_name(index_file))).close()
+    
+    # Release the parsed data before the worker picks up its next job
+    del handler, dxf_gen
+    gc.collect()
+    
+    return {
+        'output_file': output_path.name,
+        'index_file': index_file,
+        'stats': stats
+    }
 
-def convert_osm_to_dxf(job_id):
-    """Background task to convert OSM to DXF."""
-    job = conversion_jobs[job_id]
+def on_conversion_done(job_id, pool, future):
+    """Merge the result of a finished worker back into its conversion job."""
+    job = conversion_jobs.get(job_id)
+    if job is None:
+        return
     
     try:
-        job.status = 'processing'
-        job.message = 'Starting conversion...'
-        job.progress = 10
-        
-        # Input and output paths
-        input_path = Path(app.config['UPLOAD_FOLDER']) / job.filename
-        output_filename = f"{Path(job.filename).stem}_{job_id}.dxf"
-        output_path = Path(app.config['OUTPUT_FOLDER']) / output_filename
-        
-        job.message = 'Parsing OSM data...'
-        job.progress = 20
-        
-        # Parse OSM data
-        handler = OSMHandler()
-        handler.apply_file(str(input_path))
-        
-        job.message = f'Parsed {len(handler.nodes)} nodes, {len(handler.ways)} ways, {len(handler.relations)} relations'
-        job.progress = 50
-        job.stats = {
-            'nodes': len(handler.nodes),
-            'ways': len(handler.ways),
-            'relations': len(handler.relations)
-        }
-        
-        # Generate DXF
-        job.message = 'Generating DXF...'
-        job.progress = 70
-        
-        dxf_gen = DXFGenerator(job.projection, job.use_colors)
-        
-        # Process data
-        job.message = 'Processing nodes...'
-        dxf_gen.process_nodes(handler.nodes)
-        
-        job.message = 'Processing ways...'
-        job.progress = 85
-        dxf_gen.process_ways(handler.ways, handler.nodes)
-        
-        # Save DXF file
-        job.message = 'Saving DXF file...'
-        job.progress = 95
-        dxf_gen.save(str(output_path))
-        
-        # Complete job
-        job.status = 'completed'
-        job.message = 'Conversion completed successfully!'
-        job.progress = 100
-        job.completed_at = datetime.now()
-        job.output_file = output_filename
-        job.stats['layers'] = len(dxf_gen.created_layers)
-        job.stats['file_size'] = output_path.stat().st_size
-        
+        result = future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for running out of memory); every job on the pool fails
+        reset_executor(pool)
+        fail_job(job, 'Conversion worker terminated unexpectedly (the file may be too large)')
+        return
     except Exception as e:
-        job.status = 'error'
-        job.message = f'Conversion failed: {str(e)}'
-        job.error_message = str(e)
-        job.progress = 0
+        fail_job(job, str(e))
+        return
+    
+    # Complete job
+    update_job(
+        job,
+        status='completed',
+        message='Conversion completed successfully!',
+        progress=100,
+        completed_at=datetime.now(),
+        output_file=result['output_file'],
+        index_file=result['index_file'],
+        stats=result['stats']
+    )
 
 @app.route('/')
 def index():
@@ -149,7 +336,7 @@ def upload_file():
         return jsonify({'error': 'No file selected'}), 400
     
     if not allowed_file(file.filename):
-        return jsonify({'error': 'Invalid file type. Please upload .osm or .xml files'}), 400
+        return jsonify({'error': 'Invalid file type. Please upload .osm, .xml or .pbf files'}), 400
     
     # Get options from form data
     projection = request.form.get('projection', 'EPSG:3857')
@@ -166,56 +353,82 @@ def upload_file():
     
     # Create conversion job
     job = ConversionJob(job_id, filename, projection, plan_type)
-    conversion_jobs[job_id] = job
+    add_job(job)
+    
+    # Start conversion in a worker process
+    params = {
+        'input_path': str(file_path),
+        'output_path': str(Path(app.config['OUTPUT_FOLDER']) / f"{Path(filename).stem}_{job_id}.dxf"),
+        'projection': job.projection,
+        'use_colors': job.use_colors
+    }
+    pool = get_executor()
+    try:
+        future = pool.submit(convert_osm_to_dxf, params, partial(report_progress, job_id))
+    except BrokenProcessPool:
+        reset_executor(pool)
+        fail_job(job, 'Conversion service was restarting, please upload the file again')
+        return jsonify({'job_id': job_id, 'error': job.error_message, 'status': job.status}), 503
     
-    # Start conversion in background
-    thread = threading.Thread(target=convert_osm_to_dxf, args=(job_id,))
-    thread.daemon = True
-    thread.start()
+    # The worker reports its own progress messages from here on
+    update_job(job, status='processing')
+    future.add_done_callback(partial(on_conversion_done, job_id, pool))
     
     return jsonify({
         'job_id': job_id,
         'message': 'File uploaded successfully. Conversion started.',
-        'status': 'pending'
+        'status': job.status
     })
 
 @app.route('/api/status/<job_id>')
 def get_status(job_id):
     """Get conversion job status."""
-    if job_id not in conversion_jobs:
+    job = get_job(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = conversion_jobs[job_id]
-    
-    response = {
-        'job_id': job_id,
-        'status': job.status,
-        'progress': job.progress,
-        'message': job.message,
-        'created_at': job.created_at.isoformat(),
-        'stats': job.stats
-    }
-    
-    if job.completed_at:
-        response['completed_at'] = job.completed_at.isoformat()
-        response['duration'] = (job.completed_at - job.created_at).total_seconds()
-    
-    if job.error_message:
-        response['error'] = job.error_message
+    return jsonify(job_status(job))
+
+@app.route('/api/events/<job_id>')
+def job_events(job_id):
+    """Stream job status changes as Server-Sent Events until the job finishes."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
     
-    if job.output_file:
-        response['download_url'] = f'/api/download/{job_id}'
+    def events():
+        # Start from the current state, then send every later update in order
+        with jobs_updated:
+            pending = [job_status(job)]
+            sent = len(job.updates)
+        
+        while True:
+            for status in pending:
+                yield f'data: {json.dumps(status)}\n\n'
+                if status['status'] in ('completed', 'error'):
+                    return
+            
+            with jobs_updated:
+                jobs_updated.wait_for(lambda: len(job.updates) > sent, timeout=15)
+                pending = job.updates[sent:]
+                sent += len(pending)
+            
+            if not pending:
+                yield ': keep-alive\n\n'
     
-    return jsonify(response)
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/download/<job_id>')
 def download_file(job_id):
     """Download converted DXF file."""
-    if job_id not in conversion_jobs:
+    job = get_job(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = conversion_jobs[job_id]
-    
     if job.status != 'completed' or not job.output_file:
         return jsonify({'error': 'File not ready for download'}), 400
     
@@ -224,11 +437,23 @@ def download_file(job_id):
     if not file_path.exists():
         return jsonify({'error': 'File not found'}), 404
     
+    download_name = f"{Path(job.filename).stem}.dxf"
+    
+    # Let nginx serve the file from an internal location
+    accel_prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+    if accel_prefix:
+        response = Response(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{job.output_file}"
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        return response
+    
+    # With USE_X_SENDFILE enabled, send_file only sets the X-Sendfile header
     return send_file(
         str(file_path),
         as_attachment=True,
-        download_name=f"{Path(job.filename).stem}.dxf",
-        mimetype='application/octet-stream'
+        download_name=download_name,
+        mimetype='application/octet-stream',
+        conditional=True
     )
 
 @app.route('/api/jobs')
@@ -236,7 +461,10 @@ def list_jobs():
     """List all conversion jobs."""
     jobs_list = []
     
-    for job_id, job in conversion_jobs.items():
+    with jobs_lock:
+        jobs = list(conversion_jobs.items())
+    
+    for job_id, job in jobs:
         job_info = {
             'job_id': job_id,
             'filename': job.filename,
@@ -8,37 +8,84 @@ Version: 1.0.0
 """
 
 import argparse
+import functools
 import sys
+from array import array
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import logging
 
+import numpy as np
 import osmium
 import ezdxf
 from ezdxf import colors
+from ezdxf.entities import LWPolyline
 from pyproj import Transformer
 
+try:
+    import rtree
+except ImportError:  # Spatial indexing is optional
+    rtree = None
 
-class OSMNode:
-    """Represents an OSM node with coordinates and tags."""
+try:
+    from numba import njit, prange
+except ImportError:  # Fall back to NumPy for the coordinate gather
+    njit = None
+
+
+# Buffer size for writing DXF files
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class OSMNodeTable:
+    """Stores OSM nodes as parallel coordinate arrays indexed by row."""
     
-    def __init__(self, id: int, lat: float, lon: float, tags: Dict[str, str] = None):
-        self.id = id
-        self.lat = lat
+    def __init__(self, ids: np.ndarray, lon: np.ndarray, lat: np.ndarray,
+                 tags: Dict[int, Dict[str, str]] = None):
+        self.ids = ids
         self.lon = lon
-        self.tags = tags or {}
+        self.lat = lat
+        self.tags = tags or {}  # Row index -> tags, only for tagged nodes
         self.x = None  # Projected coordinates
         self.y = None
+    
+    def __len__(self) -> int:
+        return len(self.lon)
+    
+    def lookup(self, refs: np.ndarray) -> np.ndarray:
+        """Translate OSM node ids to row indices, using -1 for unknown ids."""
+        if len(self.ids) == 0:
+            return np.full(len(refs), -1, dtype=np.int64)
+        
+        # OSM files are normally sorted by id, so the argsort is usually skipped
+        if np.all(self.ids[1:] >= self.ids[:-1]):
+            order = None
+            sorted_ids = self.ids
+        else:
+            order = np.argsort(self.ids, kind='stable')
+            sorted_ids = self.ids[order]
+        
+        pos = np.searchsorted(sorted_ids, refs)
+        np.clip(pos, 0, len(sorted_ids) - 1, out=pos)
+        found = sorted_ids[pos] == refs
+        if order is not None:
+            pos = order[pos]
+        return np.where(found, pos, -1)
 
 
-class OSMWay:
-    """Represents an OSM way with node references and tags."""
+class OSMWayTable:
+    """Stores OSM ways in CSR form: one flat node index array plus offsets."""
     
-    def __init__(self, id: int, nodes: List[int], tags: Dict[str, str] = None):
-        self.id = id
-        self.nodes = nodes
-        self.tags = tags or {}
-        self.geometry = []  # Will store projected coordinates
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, node_idx: np.ndarray,
+                 tags: List[Dict[str, str]] = None):
+        self.ids = ids
+        self.offsets = offsets  # Way i uses node_idx[offsets[i]:offsets[i + 1]]
+        self.node_idx = node_idx  # Row indices into the node table, -1 if missing
+        self.tags = tags or []
+    
+    def __len__(self) -> int:
+        return len(self.ids)
 
 
 class OSMRelation:
@@ -53,64 +100,114 @@ class OSMRelation:
 class LayerMapper:
     """Maps OSM tags to DXF layers with styling."""
     
-    def __init__(self, use_colors: bool = True):
-        self.layer_config = {
-            'highway': {
-                'motorway': {'layer': 'HIGHWAY_MOTORWAY', 'color': colors.RED, 'lineweight': 100},
-                'trunk': {'layer': 'HIGHWAY_TRUNK', 'color': colors.RED, 'lineweight': 80},
-                'primary': {'layer': 'HIGHWAY_PRIMARY', 'color': colors.YELLOW, 'lineweight': 60},
-                'secondary': {'layer': 'HIGHWAY_SECONDARY', 'color': colors.CYAN, 'lineweight': 40},
-                'tertiary': {'layer': 'HIGHWAY_TERTIARY', 'color': colors.GREEN, 'lineweight': 30},
-                'residential': {'layer': 'HIGHWAY_RESIDENTIAL', 'color': colors.WHITE, 'lineweight': 20},
-                'service': {'layer': 'HIGHWAY_SERVICE', 'color': colors.GRAY, 'lineweight': 10},
-                'footway': {'layer': 'HIGHWAY_FOOTWAY', 'color': colors.MAGENTA, 'lineweight': 5},
-                'cycleway': {'layer': 'HIGHWAY_CYCLEWAY', 'color': colors.BLUE, 'lineweight': 5},
-                'path': {'layer': 'HIGHWAY_PATH', 'color': colors.GREEN, 'lineweight': 5},
-            },
-            'building': {
-                'default': {'layer': 'BUILDING', 'color': colors.GRAY, 'lineweight': 25}
-            },
-            'waterway': {
-                'river': {'layer': 'WATERWAY_RIVER', 'color': colors.BLUE, 'lineweight': 50},
-                'stream': {'layer': 'WATERWAY_STREAM', 'color': colors.BLUE, 'lineweight': 20},
-                'canal': {'layer': 'WATERWAY_CANAL', 'color': colors.BLUE, 'lineweight': 30},
-                'drain': {'layer': 'WATERWAY_DRAIN', 'color': colors.CYAN, 'lineweight': 10},
-            },
-            'natural': {
-                'water': {'layer': 'NATURAL_WATER', 'color': colors.BLUE, 'lineweight': 25},
-                'coastline': {'layer': 'NATURAL_COASTLINE', 'color': colors.BLUE, 'lineweight': 50},
-                'tree': {'layer': 'NATURAL_TREE', 'color': colors.GREEN, 'lineweight': 5},
-                'forest': {'layer': 'NATURAL_FOREST', 'color': colors.GREEN, 'lineweight': 25},
-            },
-            'amenity': {
-                'default': {'layer': 'AMENITY', 'color': colors.MAGENTA, 'lineweight': 15}
-            },
-            'landuse': {
-                'default': {'layer': 'LANDUSE', 'color': colors.YELLOW, 'lineweight': 15}
-            }
+    layer_config = {
+        'highway': {
+            'motorway': {'layer': 'HIGHWAY_MOTORWAY', 'color': colors.RED, 'lineweight': 100},
+            'trunk': {'layer': 'HIGHWAY_TRUNK', 'color': colors.RED, 'lineweight': 80},
+            'primary': {'layer': 'HIGHWAY_PRIMARY', 'color': colors.YELLOW, 'lineweight': 60},
+            'secondary': {'layer': 'HIGHWAY_SECONDARY', 'color': colors.CYAN, 'lineweight': 40},
+            'tertiary': {'layer': 'HIGHWAY_TERTIARY', 'color': colors.GREEN, 'lineweight': 30},
+            'residential': {'layer': 'HIGHWAY_RESIDENTIAL', 'color': colors.WHITE, 'lineweight': 20},
+            'service': {'layer': 'HIGHWAY_SERVICE', 'color': colors.GRAY, 'lineweight': 10},
+            'footway': {'layer': 'HIGHWAY_FOOTWAY', 'color': colors.MAGENTA, 'lineweight': 5},
+            'cycleway': {'layer': 'HIGHWAY_CYCLEWAY', 'color': colors.BLUE, 'lineweight': 5},
+            'path': {'layer': 'HIGHWAY_PATH', 'color': colors.GREEN, 'lineweight': 5},
+        },
+        'building': {
+            'default': {'layer': 'BUILDING', 'color': colors.GRAY, 'lineweight': 25}
+        },
+        'waterway': {
+            'river': {'layer': 'WATERWAY_RIVER', 'color': colors.BLUE, 'lineweight': 50},
+            'stream': {'layer': 'WATERWAY_STREAM', 'color': colors.BLUE, 'lineweight': 20},
+            'canal': {'layer': 'WATERWAY_CANAL', 'color': colors.BLUE, 'lineweight': 30},
+            'drain': {'layer': 'WATERWAY_DRAIN', 'color': colors.CYAN, 'lineweight': 10},
+        },
+        'natural': {
+            'water': {'layer': 'NATURAL_WATER', 'color': colors.BLUE, 'lineweight': 25},
+            'coastline': {'layer': 'NATURAL_COASTLINE', 'color': colors.BLUE, 'lineweight': 50},
+            'tree': {'layer': 'NATURAL_TREE', 'color': colors.GREEN, 'lineweight': 5},
+            'forest': {'layer': 'NATURAL_FOREST', 'color': colors.GREEN, 'lineweight': 25},
+        },
+        'amenity': {
+            'default': {'layer': 'AMENITY', 'color': colors.MAGENTA, 'lineweight': 15}
+        },
+        'landuse': {
+            'default': {'layer': 'LANDUSE', 'color': colors.YELLOW, 'lineweight': 15}
         }
+    }
+    
+    # Keys checked in this order, so tags matching several keys get a deterministic layer
+    priority = ('highway', 'building', 'waterway', 'natural', 'amenity', 'landuse')
     
+    # Layer for features that match no entry in layer_config
+    default_layer = ('OSM_OTHER', colors.WHITE, 10)
+    
+    def __init__(self, use_colors: bool = True):
         self.use_colors = use_colors
+        self._cache = {}  # (key, value) -> layer tuple, or None if the pair has no layer
     
-    def get_layer_info(self, tags: Dict[str, str]) -> Dict[str, any]:
-        """Get layer information based on OSM tags."""
-        for key, value in tags.items():
-            if key in self.layer_config:
-                category = self.layer_config[key]
-                if value in category:
-                    layer_info = category[value].copy()
-                    if not self.use_colors:
-                        layer_info['color'] = colors.WHITE
-                    return layer_info
-                elif 'default' in category:
-                    layer_info = category['default'].copy()
-                    if not self.use_colors:
-                        layer_info['color'] = colors.WHITE
-                    return layer_info
+    def _resolve(self, key: str, value: str) -> Optional[Tuple[str, int, int]]:
+        """Look up the layer for a single tag in layer_config."""
+        category = self.layer_config[key]
+        entry = category.get(value) or category.get('default')
+        if entry is None:
+            return None
+        color = entry['color'] if self.use_colors else colors.WHITE
+        return (entry['layer'], color, entry['lineweight'])
+    
+    def get_layer_info(self, tags: Dict[str, str]) -> Tuple[str, int, int]:
+        """Get (layer, color, lineweight) based on OSM tags."""
+        cache = self._cache
+        for key in self.priority:
+            value = tags.get(key)
+            if value is None:
+                continue
+            try:
+                layer_info = cache[key, value]
+            except KeyError:
+                layer_info = cache[key, value] = self._resolve(key, value)
+            if layer_info is not None:
+                return layer_info
         
         # Default layer for unmatched features
-        default_color = colors.WHITE if self.use_colors else colors.WHITE
-        return {'layer': 'OSM_OTHER', 'color': default_color, 'lineweight': 10}
+        return self.default_layer
+
+
+# OSM keys that LayerMapper assigns a dedicated layer to
+RELEVANT_KEYS = frozenset(LayerMapper.layer_config)
+
+# OSM keys that turn a node into a point feature
+NODE_KEYS = frozenset(('amenity', 'shop', 'tourism', 'highway'))
+
+
+def _gather_way_coords_numpy(offsets: np.ndarray, node_idx: np.ndarray,
+                             xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """Gather (x, y) rows for every CSR node index, so way w is out[offsets[w]:offsets[w + 1]]."""
+    coords = np.empty((len(node_idx), 2))
+    coords[:, 0] = xs[node_idx]
+    coords[:, 1] = ys[node_idx]
+    return coords
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def gather_way_coords(offsets, node_idx, xs, ys):
+        """Numba version of _gather_way_coords_numpy, parallel over ways."""
+        coords = np.empty((len(node_idx), 2))
+        for w in prange(len(offsets) - 1):
+            for k in range(offsets[w], offsets[w + 1]):
+                i = node_idx[k]
+                coords[k, 0] = xs[i]
+                coords[k, 1] = ys[i]
+        return coords
+else:
+    gather_way_coords = _gather_way_coords_numpy
+
+
+@functools.lru_cache(maxsize=32)
+def get_transformer(target_crs: str) -> Transformer:
+    """Return a shared WGS84 -> target_crs transformer, built once per process."""
+    return Transformer.from_crs("EPSG:4326", target_crs, always_xy=True)
 
 
 class CoordinateTransformer:
@@ -118,39 +215,103 @@ class CoordinateTransformer:
     
     def __init__(self, target_crs: str = "EPSG:3857"):
         """Initialize transformer. Default is Web Mercator."""
-        self.transformer = Transformer.from_crs("EPSG:4326", target_crs, always_xy=True)
+        self.transformer = get_transformer(target_crs)
         self.target_crs = target_crs
     
     def transform(self, lon: float, lat: float) -> Tuple[float, float]:
         """Transform WGS84 coordinates to target projection."""
         return self.transformer.transform(lon, lat)
+    
+    def transform_arrays(self, lons: np.ndarray, lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Transform arrays of WGS84 coordinates in a single batched PROJ call."""
+        return self.transformer.transform(lons, lats)
 
 
 class OSMHandler(osmium.SimpleHandler):
     """OSM data handler using osmium for efficient parsing."""
     
-    def __init__(self):
+    def __init__(self, store_relations: bool = False):
+        """Relations are only counted unless store_relations is set, as nothing draws them yet."""
         osmium.SimpleHandler.__init__(self)
-        self.nodes = {}
-        self.ways = []
+        self.store_relations = store_relations
+        self._lon = array('d')
+        self._lat = array('d')
+        self._node_ids = array('q')
+        self._node_tags = {}
+        self._way_ids = array('q')
+        self._way_refs = array('q')
+        self._way_offsets = array('q', [0])
+        self._way_tags = []
+        self.nodes = OSMNodeTable(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        self.ways = OSMWayTable(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                                np.empty(0, dtype=np.int64))
         self.relations = []
+        self.relation_count = 0
         self.bounds = None
     
+    def apply_file(self, *args, **kwargs):
+        """Parse an OSM file and build the node and way tables from the collected arrays."""
+        super().apply_file(*args, **kwargs)
+        self.nodes = OSMNodeTable(
+            np.frombuffer(self._node_ids, dtype=np.int64),
+            np.frombuffer(self._lon, dtype=np.float64),
+            np.frombuffer(self._lat, dtype=np.float64),
+            self._node_tags
+        )
+        self.ways = OSMWayTable(
+            np.frombuffer(self._way_ids, dtype=np.int64),
+            np.frombuffer(self._way_offsets, dtype=np.int64),
+            self.nodes.lookup(np.frombuffer(self._way_refs, dtype=np.int64)),
+            self._way_tags
+        )
+    
     def node(self, n):
         """Process OSM nodes."""
-        tags = dict(n.tags) if n.tags else {}
-        node = OSMNode(n.id, n.location.lat, n.location.lon, tags)
-        self.nodes[n.id] = node
+        idx = len(self._lon)
+        self._node_ids.append(n.id)
+        self._lon.append(n.location.lon)
+        self._lat.append(n.location.lat)
+        
+        # Only build a tag dict for nodes that become point features;
+        # a plain loop keeps the per-node check allocation free
+        node_tags = n.tags
+        if node_tags:
+            for key in NODE_KEYS:
+                if key in node_tags:
+                    self._node_tags[idx] = dict(node_tags)
+                    break
     
     def way(self, w):
         """Process OSM ways."""
-        tags = dict(w.tags) if w.tags else {}
-        nodes = [n.ref for n in w.nodes]
-        way = OSMWay(w.id, nodes, tags)
-        self.ways.append(way)
+        way_tags = w.tags
+        if not way_tags:
+            return
+        
+        # Keep only the tags used for layer and polygon detection; ways without
+        # a layer-relevant tag are never drawn, so don't store them
+        tags = {}
+        for key in RELEVANT_KEYS:
+            value = way_tags.get(key)
+            if value is not None:
+                tags[key] = value
+        if not tags:
+            return
+        
+        area = way_tags.get('area')
+        if area is not None:
+            tags['area'] = area
+        
+        self._way_ids.append(w.id)
+        self._way_refs.extend([n.ref for n in w.nodes])
+        self._way_offsets.append(len(self._way_refs))
+        self._way_tags.append(tags)
     
     def relation(self, r):
         """Process OSM relations."""
+        self.relation_count += 1
+        if not self.store_relations:
+            return
+        
         tags = dict(r.tags) if r.tags else {}
         members = [(m.type, m.ref, m.role) for m in r.members]
         relation = OSMRelation(r.id, members, tags)
@@ -166,6 +327,12 @@ class DXFGenerator:
         self.layer_mapper = LayerMapper(use_colors)
         self.coord_transformer = CoordinateTransformer(target_crs)
         self.created_layers = set()
+        # OSM ids and (xmin, ymin, xmax, ymax) bounding boxes of the drawn ways
+        self.way_ids = np.empty(0, dtype=np.int64)
+        self.way_bounds = np.empty((0, 4))
+        self.spatial_index = None
+        # Layer tuple -> (circle centers, (coordinates, closed) polylines) awaiting emission
+        self.pending_entities = defaultdict(lambda: ([], []))
     
     def create_layer(self, layer_name: str, color: int, lineweight: int):
         """Create a DXF layer with specified properties."""
@@ -175,69 +342,141 @@ class DXFGenerator:
             layer.lineweight = lineweight
             self.created_layers.add(layer_name)
     
-    def process_nodes(self, nodes: Dict[int, OSMNode]):
+    def process_nodes(self, nodes: OSMNodeTable):
         """Transform node coordinates and create point features for tagged nodes."""
         logging.info(f"Processing {len(nodes)} nodes...")
         
-        for node in nodes.values():
-            # Transform coordinates
-            node.x, node.y = self.coord_transformer.transform(node.lon, node.lat)
-            
-            # Create point features for nodes with significant tags
-            if node.tags and any(key in ['amenity', 'shop', 'tourism', 'highway'] for key in node.tags.keys()):
-                layer_info = self.layer_mapper.get_layer_info(node.tags)
-                self.create_layer(layer_info['layer'], layer_info['color'], layer_info['lineweight'])
-                
-                # Create a point or small circle for the node
-                self.msp.add_circle(
-                    center=(node.x, node.y),
-                    radius=5.0,  # 5 meter radius
-                    dxfattribs={'layer': layer_info['layer']}
-                )
+        # Transform all coordinates at once
+        nodes.x, nodes.y = self.coord_transformer.transform_arrays(nodes.lon, nodes.lat)
+        
+        # Queue point features per layer; emit_entities() adds them to the modelspace
+        for idx, tags in nodes.tags.items():
+            x, y = float(nodes.x[idx]), float(nodes.y[idx])
+            self.pending_entities[self.layer_mapper.get_layer_info(tags)][0].append((x, y))
     
-    def process_ways(self, ways: List[OSMWay], nodes: Dict[int, OSMNode]):
+    def process_ways(self, ways: OSMWayTable, nodes: OSMNodeTable):
         """Convert OSM ways to DXF polylines."""
         logging.info(f"Processing {len(ways)} ways...")
         
-        for way in ways:
-            if not way.tags:
+        # Drop refs to nodes missing from the extract, then gather all way coordinates at once
+        valid = ways.node_idx >= 0
+        node_idx = ways.node_idx[valid]
+        offsets = np.concatenate(([0], np.cumsum(valid)))[ways.offsets]
+        coords = gather_way_coords(offsets, node_idx, nodes.x, nodes.y)
+        
+        offsets = offsets.tolist()
+        drawn, starts, ends = [], [], []
+        
+        for w, tags in enumerate(ways.tags):
+            if not tags:
                 continue
             
-            # Get coordinates for way nodes
-            coordinates = []
-            for node_id in way.nodes:
-                if node_id in nodes:
-                    node = nodes[node_id]
-                    coordinates.append((node.x, node.y))
+            start, end = offsets[w], offsets[w + 1]
             
-            if len(coordinates) < 2:
+            # Polygon (closed polyline) or open polyline
+            closed = tags.get('area') == 'yes' or 'building' in tags or 'landuse' in tags
+            if closed and end > start and node_idx[start] == node_idx[end - 1]:
+                end -= 1  # The closed flag already draws the closing segment
+            
+            if end - start < 2:
                 continue
             
             # Determine layer and styling
-            layer_info = self.layer_mapper.get_layer_info(way.tags)
-            self.create_layer(layer_info['layer'], layer_info['color'], layer_info['lineweight'])
-            
-            # Create polyline or polygon
-            if way.tags.get('area') == 'yes' or 'building' in way.tags or 'landuse' in way.tags:
-                # Create polygon (closed polyline)
-                if coordinates[0] != coordinates[-1]:
-                    coordinates.append(coordinates[0])  # Close the polygon
-                
-                polyline = self.msp.add_lwpolyline(
-                    coordinates,
-                    close=True,
-                    dxfattribs={'layer': layer_info['layer']}
-                )
-            else:
-                # Create polyline (open)
-                polyline = self.msp.add_lwpolyline(
-                    coordinates,
-                    dxfattribs={'layer': layer_info['layer']}
+            layer_info = self.layer_mapper.get_layer_info(tags)
+            self.pending_entities[layer_info][1].append((coords[start:end], closed))
+            drawn.append(w)
+            starts.append(start)
+            ends.append(end)
+        
+        self.record_way_bounds(ways.ids[drawn], coords, starts, ends)
+    
+    def emit_entities(self):
+        """Add all queued circles and polylines to the modelspace, one layer at a time.
+        
+        Every layer's entities end up contiguous in the DXF, whether they came
+        from nodes or ways. save() calls this automatically.
+        """
+        pending, self.pending_entities = self.pending_entities, defaultdict(lambda: ([], []))
+        
+        # Create all required layers up front
+        for layer_name, color, lineweight in pending:
+            self.create_layer(layer_name, color, lineweight)
+        
+        for (layer_name, color, lineweight), (circles, polylines) in pending.items():
+            # Create a point or small circle for each node
+            for center in circles:
+                self.msp.add_circle(
+                    center=center,
+                    radius=5.0,  # 5 meter radius
+                    dxfattribs={'layer': layer_name}
                 )
+            self.add_polylines(layer_name, polylines)
+    
+    def add_polylines(self, layer_name: str, polylines: List[Tuple[np.ndarray, bool]]):
+        """Add (coordinates, closed) polylines on one layer to the modelspace."""
+        msp = self.msp
+        for coordinates, closed in polylines:
+            # Build the entity directly instead of going through add_lwpolyline
+            polyline = LWPolyline.new(dxfattribs={'layer': layer_name})
+            polyline.set_points(coordinates, format='xy')
+            polyline.closed = closed
+            msp.add_entity(polyline)
+    
+    def record_way_bounds(self, way_ids: np.ndarray, coords: np.ndarray,
+                          starts: List[int], ends: List[int]):
+        """Store the bounding box of coords[starts[i]:ends[i]] for each drawn way."""
+        if not starts:
+            return
+        
+        # reduceat over interleaved (start, end) pairs; the even results are the way ranges
+        bounds_idx = np.empty(2 * len(starts), dtype=np.int64)
+        bounds_idx[0::2] = starts
+        bounds_idx[1::2] = ends
+        bounds = np.empty((len(starts), 4))
+        for axis in (0, 1):
+            values = np.append(coords[:, axis], 0.0)  # Pad so an end index may equal len(coords)
+            bounds[:, axis] = np.minimum.reduceat(values, bounds_idx)[0::2]
+            bounds[:, axis + 2] = np.maximum.reduceat(values, bounds_idx)[0::2]
+        
+        self.way_ids = np.concatenate((self.way_ids, way_ids))
+        self.way_bounds = np.concatenate((self.way_bounds, bounds))
+    
+    def build_spatial_index(self, path: Optional[str] = None):
+        """Build an R-tree of the drawn ways' bounding boxes, keyed by OSM way id.
+        
+        If path is given, the index is written to path.idx / path.dat for later queries.
+        """
+        if rtree is None:
+            raise RuntimeError("Spatial indexing requires the 'rtree' package")
+        
+        properties = rtree.index.Property()
+        if path is not None:
+            properties.overwrite = True
+        
+        entries = ((way_id, tuple(bbox), None)
+                   for way_id, bbox in zip(self.way_ids.tolist(), self.way_bounds.tolist()))
+        
+        # Bulk loading packs the tree, which builds and queries faster than inserts
+        args = [] if path is None else [str(path)]
+        if len(self.way_ids):
+            args.append(entries)
+        self.spatial_index = rtree.index.Index(*args, properties=properties)
+        
+        logging.info(f"Spatial index built for {len(self.way_ids)} ways")
+        return self.spatial_index
     
-    def save(self, output_path: str):
-        """Save the DXF document."""
-        self.doc.saveas(output_path)
+    def save(self, output_path: str, fmt: str = 'asc'):
+        """Save the DXF document as ASCII ('asc') or binary ('bin') DXF."""
+        self.emit_entities()
+        self.doc.filename = str(output_path)
+        # Large buffer to keep the number of write syscalls low on big drawings
+        if fmt == 'bin':
+            fp = open(output_path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        else:
+            fp = open(output_path, 'wt', buffering=WRITE_BUFFER_SIZE,
+                      encoding=self.doc.output_encoding, errors='dxfreplace')
+        with fp:
+            self.doc.write(fp, fmt=fmt)
         logging.info(f"DXF file saved: {output_path}")
 
 
@@ -261,14 +500,16 @@ Examples:
   python osm_to_dxf.py map.osm
   python osm_to_dxf.py map.osm --output map.dxf --projection EPSG:32633
   python osm_to_dxf.py map.osm --verbose
+  python osm_to_dxf.py map.osm.pbf
         """
     )
     
-    parser.add_argument('input_file', help='Input OSM file path')
+    parser.add_argument('input_file', help='Input OSM file path (.osm, .xml or .pbf)')
     parser.add_argument('-o', '--output', help='Output DXF file path (default: input_file.dxf)')
     parser.add_argument('-p', '--projection', default='EPSG:3857', 
                        help='Target coordinate system (default: EPSG:3857 - Web Mercator)')
     parser.add_argument('--no-colors', action='store_true', help='Generate monochrome DXF (all layers in white)')
+    parser.add_argument('--binary', action='store_true', help='Write binary DXF (smaller and faster to write)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
@@ -297,7 +538,7 @@ Examples:
         handler = OSMHandler()
         handler.apply_file(str(input_path))
         
-        logging.info(f"Parsed {len(handler.nodes)} nodes, {len(handler.ways)} ways, {len(handler.relations)} relations")
+        logging.info(f"Parsed {len(handler.nodes)} nodes, {len(handler.ways)} ways, {handler.relation_count} relations")
         
         # Generate DXF
         logging.info("Generating DXF...")
@@ -309,7 +550,7 @@ Examples:
         dxf_gen.process_ways(handler.ways, handler.nodes)
         
         # Save DXF file
-        dxf_gen.save(output_path)
+        dxf_gen.save(output_path, fmt='bin' if args.binary else 'asc')
         
         logging.info("Conversion completed successfully!")
         logging.info(f"Created {len(dxf_gen.created_layers)} layers")